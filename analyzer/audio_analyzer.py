@@ -4,29 +4,167 @@ Audio-to-LED Brightness Analyzer
 Converts audio files into Arduino-compatible LED brightness data
 """
 
-import librosa
 import numpy as np
-import matplotlib.pyplot as plt
+import soundfile as sf
+import math
+from dataclasses import dataclass
+from functools import lru_cache
 import os
 import sys
 
+try:
+    import numpy_rms
+except ImportError:
+    numpy_rms = None
+
+# Importing numba and loading the cached kernel costs ~0.4 s per process.
+# Measured single-threaded, the energy kernel takes ~0.56 ns/sample against
+# ~1.44 ns/sample for plain NumPy and ~0.37 ns/sample for numpy-rms, so it
+# never beats numpy-rms and on one core needs ~450M samples to repay the
+# load. Assuming prange scales across cores, two cores break even near 350M
+# samples (~2.2 h at 44.1 kHz); that multi-core scaling is not benchmarked.
+_JIT_MIN_SAMPLES = 350_000_000
+
+
+def _use_jit(n_samples):
+    """Whether the numba energy kernel is worth loading for this many samples"""
+    return (
+        numpy_rms is None
+        and (os.cpu_count() or 1) > 1
+        and n_samples >= _JIT_MIN_SAMPLES
+    )
+
+
+def _percentile_bounds(values, lo_pct, hi_pct):
+    """Two percentiles (linear interpolation, like np.percentile) from one partition"""
+    n = len(values)
+    lo_pos = lo_pct / 100.0 * (n - 1)
+    hi_pos = hi_pct / 100.0 * (n - 1)
+    lo = int(math.floor(lo_pos))
+    hi = int(math.floor(hi_pos))
+    lo_next = min(lo + 1, n - 1)
+    hi_next = min(hi + 1, n - 1)
+    
+    part = np.partition(values, np.array([lo, lo_next, hi, hi_next]))
+    
+    lo_val = float(part[lo]) + (float(part[lo_next]) - float(part[lo])) * (lo_pos - lo)
+    hi_val = float(part[hi]) + (float(part[hi_next]) - float(part[hi])) * (hi_pos - hi)
+    return lo_val, hi_val
+
+
+@lru_cache(maxsize=None)
+def _jit_energy_kernel(win):
+    """Energy kernel specialized for one window size, built on first use; None without numba"""
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+    
+    # win is captured as a compile-time constant, so the inner loop has a
+    # fixed trip count; numba caches one compiled kernel per window size.
+    # 'reassoc' lets LLVM split the float32 sum across SIMD lanes; the
+    # dB conversion itself stays strict.
+    @njit(parallel=True, fastmath={'reassoc'}, cache=True)
+    def energy_kernel(audio):
+        """Per-window energy in dB, trailing partial window included, frames spread across cores"""
+        n = len(audio)
+        n_full = n // win
+        n_frames = n_full + (1 if n % win else 0)
+        energy_db = np.empty(n_frames, dtype=np.float32)
+        for i in prange(n_full):
+            base = i * win
+            acc = np.float32(0.0)
+            for j in range(win):
+                v = audio[base + j]
+                acc += v * v
+            # Silence floors at -100 dB
+            energy_db[i] = 20.0 * math.log10(max(math.sqrt(acc / win), 1e-5))
+        
+        # Trailing partial window
+        if n_frames > n_full:
+            acc = 0.0
+            for j in range(n_full * win, n):
+                v = audio[j]
+                acc += v * v
+            energy_db[n_full] = 20.0 * math.log10(max(math.sqrt(acc / (n - n_full * win)), 1e-5))
+        return energy_db
+    
+    return energy_kernel
+
+
+def _frame_rms(samples, window_samples):
+    """RMS of every full window in one pass"""
+    n_full = len(samples) // window_samples
+    if numpy_rms is not None and n_full:
+        # SIMD kernel: fuses square, mean and sqrt without a temp buffer
+        return numpy_rms.rms(samples, window_samples)
+    # Trim to whole windows once and view as (frames, window)
+    body = samples[:n_full * window_samples].reshape(n_full, window_samples)
+    squared = np.square(body, dtype=np.float32)
+    return np.sqrt(squared.mean(axis=1, dtype=np.float32))
+
+
+def _energy_db(samples, window_samples, use_jit=False):
+    """Per-window energy in dB, including a trailing partial window"""
+    kernel = _jit_energy_kernel(window_samples) if use_jit else None
+    if kernel is not None:
+        return kernel(np.ascontiguousarray(samples, dtype=np.float32))
+    
+    rms = _frame_rms(samples, window_samples)
+    
+    remainder = len(samples) % window_samples
+    if remainder:
+        tail = samples[-remainder:]
+        rms = np.append(rms, np.sqrt(np.square(tail, dtype=np.float32).mean(dtype=np.float32)))
+    
+    # Silence floors at -100 dB
+    return 20 * np.log10(np.maximum(rms, 1e-5))
+
+@dataclass
+class BrightnessStats:
+    """Summary metrics of a brightness array"""
+    average: float
+    active_pct: float
+    
+    @classmethod
+    def from_levels(cls, brightness_levels):
+        """Compute both metrics from a single > 0 mask"""
+        active = brightness_levels > 0
+        average = float(brightness_levels[active].mean()) if active.any() else 0.0
+        active_pct = float(active.mean() * 100) if len(active) else 0.0
+        return cls(average, active_pct)
+
 class AudioLEDAnalyzer:
     def __init__(self):
         self.audio_data = None
         self.sample_rate = None
         self.duration = None
+        self.stats = None
         
     def load_audio(self, filename):
         """Load audio file and extract data"""
         try:
             print(f"Loading {filename}...")
             
-            self.audio_data, self.sample_rate = librosa.load(
-                filename, 
-                sr=None,
-                mono=True
-            )
+            try:
+                # libsndfile decodes WAV/FLAC/OGG directly
+                data, self.sample_rate = sf.read(
+                    filename,
+                    dtype='float32',
+                    always_2d=True
+                )
+                self.audio_data = data.mean(axis=1) if data.shape[1] > 1 else data[:, 0]
+            except RuntimeError:
+                # Formats libsndfile can't read (e.g. MP3 on older builds)
+                import librosa
+                self.audio_data, self.sample_rate = librosa.load(
+                    filename, 
+                    sr=None,
+                    mono=True
+                )
             
+            # Keep float32 end to end so later reductions never promote to float64
+            self.audio_data = self.audio_data.astype(np.float32, copy=False)
             self.duration = len(self.audio_data) / self.sample_rate
             
             print(f"✓ Audio loaded successfully!")
@@ -42,85 +180,147 @@ class AudioLEDAnalyzer:
         """Calculate LED brightness levels from audio volume"""
         if self.audio_data is None:
             print("No audio data loaded!")
-            return []
+            return np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.float32)
         
         print(f"Analyzing audio volume...")
         
         window_samples = int(self.sample_rate * window_ms / 1000)
-        energy_db = []
+
+        use_jit = _use_jit(len(self.audio_data))
+        energy_db = _energy_db(self.audio_data, window_samples, use_jit)
+        brightness_levels, noise_floor, max_energy = self._map_brightness(energy_db)
         
-        for i in range(0, len(self.audio_data), window_samples):
-            window = self.audio_data[i:i + window_samples]
+        self._report_levels(brightness_levels, noise_floor, max_energy)
+        
+        return brightness_levels, energy_db
+    
+    def stream_brightness(self, filename, window_ms=100, blocksize=1_048_576):
+        """Calculate brightness block by block without keeping the whole track in memory"""
+        try:
+            info = sf.info(filename)
+        except RuntimeError:
+            # libsndfile can't read this format (e.g. MP3 on older builds);
+            # librosa can, but only by loading the whole file
+            print(f"⚠ Can't stream {filename} with soundfile, loading it into memory instead")
+            if not self.load_audio(filename):
+                return None
+            return self.calculate_brightness(window_ms)
+
+        try:
+            print(f"Streaming {filename}...")
+
+            self.audio_data = None
+            self.sample_rate = info.samplerate
+            self.duration = info.frames / info.samplerate
             
-            if len(window) == 0:
-                break
-                
-            rms_energy = np.sqrt(np.mean(window ** 2))
+            window_samples = int(self.sample_rate * window_ms / 1000)
+            expected_frames = -(-info.frames // window_samples)
+            energy_db = np.empty(expected_frames, dtype=np.float32)
+            use_jit = _use_jit(info.frames)
             
-            if rms_energy > 0:
-                energy_in_db = 20 * np.log10(rms_energy)
-            else:
-                energy_in_db = -100
+            pos = 0
+            carry = np.empty(0, dtype=np.float32)
+            for block in sf.blocks(filename, blocksize=blocksize, dtype='float32', always_2d=True):
+                mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+                if len(carry):
+                    mono = np.concatenate((carry, mono))
                 
-            energy_db.append(energy_in_db)
+                # Whole windows now, leftover samples carry into the next block
+                n_full = len(mono) // window_samples
+                energy_db[pos:pos + n_full] = _energy_db(
+                    mono[:n_full * window_samples], window_samples, use_jit
+                )
+                pos += n_full
+                carry = mono[n_full * window_samples:]
+            
+            if len(carry):
+                energy_db[pos] = _energy_db(carry, window_samples)[0]
+                pos += 1
+            energy_db = energy_db[:pos]
+            
+            print(f"✓ Audio streamed successfully!")
+            print(f"  Duration: {self.duration:.2f} seconds")
+            
+        except Exception as e:
+            print(f"✗ Error streaming audio: {e}")
+            return None
         
-        energy_array = np.array(energy_db)
+        print(f"Analyzing audio volume...")
         
-        # Dynamic range detection
-        noise_floor = np.percentile(energy_array, 15)
-        max_energy = np.percentile(energy_array, 85)
+        brightness_levels, noise_floor, max_energy = self._map_brightness(energy_db)
+        self._report_levels(brightness_levels, noise_floor, max_energy)
         
-        print(f"  Noise floor: {noise_floor:.1f} dB")
-        print(f"  Max energy: {max_energy:.1f} dB")
-        print(f"  Dynamic range: {max_energy - noise_floor:.1f} dB")
+        return brightness_levels, energy_db
+    
+    def _map_brightness(self, energy_db):
+        """Map energy in dB to smoothed 0-255 brightness"""
+        # Dynamic range detection
+        noise_floor, max_energy = _percentile_bounds(energy_db, 15, 85)
         
         # Convert to brightness values (0-255)
-        brightness_levels = []
-        
-        for energy in energy_db:
-            if energy <= noise_floor:
-                brightness = 0
-            elif energy >= max_energy:
-                brightness = 255
-            else:
-                normalized = (energy - noise_floor) / (max_energy - noise_floor)
-                brightness = int(normalized * 255)
-                
-            brightness = max(0, min(255, brightness))
-            brightness_levels.append(brightness)
+        normalized = (energy_db - noise_floor) / max(max_energy - noise_floor, 1e-9)
+        # Clip in float before the cast so huge ratios can't wrap around
+        brightness_levels = np.clip(normalized * 255.0, 0, 255).astype(np.uint8)
         
         # Smooth to prevent flickering
         brightness_levels = self._smooth_brightness(brightness_levels)
         
-        avg_brightness = np.mean([b for b in brightness_levels if b > 0])
-        print(f"  Average brightness: {avg_brightness:.1f}/255")
-        print(f"  Active time: {sum(1 for b in brightness_levels if b > 0)/len(brightness_levels)*100:.1f}%")
+        return brightness_levels, noise_floor, max_energy
+    
+    def _report_levels(self, brightness_levels, noise_floor, max_energy):
+        """Print dynamic range and brightness summary"""
+        print(f"  Noise floor: {noise_floor:.1f} dB")
+        print(f"  Max energy: {max_energy:.1f} dB")
+        print(f"  Dynamic range: {max_energy - noise_floor:.1f} dB")
         
-        return brightness_levels, energy_db
+        self.stats = BrightnessStats.from_levels(brightness_levels)
+        print(f"  Average brightness: {self.stats.average:.1f}/255")
+        print(f"  Active time: {self.stats.active_pct:.1f}%")
     
     def _smooth_brightness(self, brightness_levels, window_size=3):
         """Apply smoothing to reduce LED flickering"""
-        smoothed = brightness_levels.copy()
+        half = window_size // 2
+        n = len(brightness_levels)
         
-        for i in range(len(brightness_levels)):
-            start = max(0, i - window_size // 2)
-            end = min(len(brightness_levels), i + window_size // 2 + 1)
-            
-            window_values = brightness_levels[start:end]
-            smoothed[i] = int(np.mean(window_values))
+        # Running-sum box filter: cost is independent of window size.
+        # Windows are truncated at the edges and divided by their real length.
+        sums = np.concatenate(([0], np.cumsum(brightness_levels, dtype=np.int64)))
+        idx = np.arange(n)
+        start = np.maximum(idx - half, 0)
+        end = np.minimum(idx + half + 1, n)
+        smoothed = (sums[end] - sums[start]) // (end - start)
         
-        return smoothed
+        return smoothed.astype(np.uint8)
     
     def create_visualization(self, brightness_levels, energy_db, window_ms=100, output_file="audio_analysis.png"):
         """Generate and save visualization"""
         try:
+            # Imported here so analysis/export-only runs skip matplotlib startup
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+            
             time_points = np.arange(len(brightness_levels)) * window_ms / 1000.0
             
+            dpi = 100
             fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(15, 10))
             
-            # Waveform
-            time_audio = np.linspace(0, self.duration, len(self.audio_data))
-            ax1.plot(time_audio, self.audio_data, alpha=0.7, color='blue')
+            # Waveform (not kept when streaming): min/max of each ~1 pixel
+            # bucket, so peaks survive with only 2 points per pixel
+            if self.audio_data is not None:
+                step = max(1, len(self.audio_data) // (15 * dpi))
+                n_full = len(self.audio_data) // step
+                buckets = self.audio_data[:n_full * step].reshape(n_full, step)
+                lows, highs = buckets.min(axis=1), buckets.max(axis=1)
+                tail = self.audio_data[n_full * step:]
+                if len(tail):
+                    lows = np.append(lows, tail.min())
+                    highs = np.append(highs, tail.max())
+                y_env = np.empty(2 * len(lows), dtype=self.audio_data.dtype)
+                y_env[0::2] = lows
+                y_env[1::2] = highs
+                time_audio = np.repeat(np.arange(len(lows)) * step / self.sample_rate, 2)
+                ax1.plot(time_audio, y_env, alpha=0.7, color='blue', rasterized=True)
             ax1.set_title('Audio Waveform')
             ax1.set_ylabel('Amplitude')
             ax1.grid(True, alpha=0.3)
@@ -132,9 +332,21 @@ class AudioLEDAnalyzer:
             ax2.grid(True, alpha=0.3)
             
             # LED brightness
-            colors = plt.cm.viridis(np.array(brightness_levels) / 255.0)
-            ax3.bar(time_points, brightness_levels, width=window_ms/1000.0, 
-                   color=colors, alpha=0.8, edgecolor='none')
+            # One colormapped image clipped to the bar outline, instead of one patch per bar
+            # Each bar is centered on its time point, like ax3.bar was
+            levels = np.asarray(brightness_levels, dtype=np.uint8)
+            if len(levels):
+                half_window = window_ms / 2000.0
+                end_time = len(levels) * window_ms / 1000.0
+                image = ax3.imshow(levels[None, :], aspect='auto', cmap='viridis',
+                                   extent=[-half_window, end_time - half_window, 0, 255],
+                                   vmin=0, vmax=255, alpha=0.8)
+                outline = ax3.fill_between(np.append(time_points, end_time) - half_window,
+                                           np.append(levels, levels[-1:]),
+                                           step='post', facecolor='none', edgecolor='none')
+                image.set_clip_path(outline.get_paths()[0], transform=ax3.transData)
+            # imshow pins the limits to the image; line up with the energy panel
+            ax3.set_xlim(ax2.get_xlim())
             ax3.set_title('LED Brightness Levels (0-255)')
             ax3.set_xlabel('Time (seconds)')
             ax3.set_ylabel('Brightness')
@@ -142,38 +354,45 @@ class AudioLEDAnalyzer:
             ax3.grid(True, alpha=0.3)
             
             plt.tight_layout()
-            plt.savefig(output_file, dpi=150, bbox_inches='tight')
+            plt.savefig(output_file, dpi=dpi, bbox_inches='tight')
             print(f"✓ Visualization saved: {output_file}")
             plt.close()
             
         except Exception as e:
             print(f"Could not create visualization: {e}")
     
-    def export_arduino_data(self, brightness_levels, window_ms=100, output_file="brightness_data.h"):
-        """Export brightness data as Arduino header file"""
+    def export_arduino_data(self, brightness_levels, window_ms=100, output_file="brightness_data.h", stats=None):
+        """Export brightness data as Arduino header file; pass stats to reuse precomputed metrics"""
         try:
-            with open(output_file, 'w') as f:
-                f.write("#ifndef BRIGHTNESS_DATA_H\n")
-                f.write("#define BRIGHTNESS_DATA_H\n")
-                f.write("#include <avr/pgmspace.h>\n\n")
-                
-                f.write("const unsigned char brightnessArray[] PROGMEM = {\n")
-                
-                # Write array data in rows of 16
-                for i in range(0, len(brightness_levels), 16):
-                    row = brightness_levels[i:i+16]
-                    row_str = ", ".join(f"{b:3d}" for b in row)
-                    time_str = f"{i * window_ms / 1000:.1f}s"
-                    
-                    if i + 16 < len(brightness_levels):
-                        f.write(f"    {row_str},  // {time_str}\n")
-                    else:
-                        f.write(f"    {row_str}   // {time_str}\n")
-                
-                f.write("};\n")
-                f.write(f"const int arraySize = {len(brightness_levels)};\n")
-                f.write(f"const int ms = {window_ms};\n\n")
-                f.write("#endif\n")
+            brightness_levels = np.asarray(brightness_levels, dtype=np.uint8)
+            
+            # Format every value in one call, then split into rows of 16
+            cells = np.char.mod('%3d', brightness_levels).astype(np.bytes_)
+            full = len(cells) // 16 * 16
+            row_cells = list(cells[:full].reshape(-1, 16))
+            if full < len(cells):
+                row_cells.append(cells[full:])
+            
+            # Assemble the whole header in one buffer
+            buf = bytearray(
+                b"#ifndef BRIGHTNESS_DATA_H\n"
+                b"#define BRIGHTNESS_DATA_H\n"
+                b"#include <avr/pgmspace.h>\n\n"
+                b"const unsigned char brightnessArray[] PROGMEM = {\n"
+            )
+            for r, row in enumerate(row_cells):
+                separator = b"," if r + 1 < len(row_cells) else b" "
+                buf += b"    " + b", ".join(row) + separator
+                buf += f"  // {r * 16 * window_ms / 1000:.1f}s\n".encode()
+            buf += (
+                "};\n"
+                f"const int arraySize = {len(brightness_levels)};\n"
+                f"const int ms = {window_ms};\n\n"
+                "#endif\n"
+            ).encode()
+            
+            with open(output_file, 'wb') as f:
+                f.write(buf)
             
             print(f"✓ Arduino data exported: {output_file}")
             
@@ -182,8 +401,9 @@ class AudioLEDAnalyzer:
             print(f"  Array size: {len(brightness_levels)} values")
             print(f"  Duration: {len(brightness_levels) * window_ms / 1000:.1f} seconds")
             print(f"  Time resolution: {window_ms}ms")
-            avg_brightness = np.mean([b for b in brightness_levels if b > 0])
-            print(f"  Average brightness: {avg_brightness:.1f}/255")
+            if stats is None:
+                stats = BrightnessStats.from_levels(brightness_levels)
+            print(f"  Average brightness: {stats.average:.1f}/255")
             
         except Exception as e:
             print(f"Error exporting data: {e}")
@@ -195,9 +415,11 @@ def main():
     
     analyzer = AudioLEDAnalyzer()
     
-    # Get filename
-    if len(sys.argv) > 1:
-        filename = sys.argv[1]
+    # Get filename; --stream may appear anywhere on the command line
+    args = [arg for arg in sys.argv[1:] if arg != "--stream"]
+    stream = len(args) < len(sys.argv) - 1
+    if args:
+        filename = args[0]
     else:
         filename = input("Enter audio filename (MP3/WAV): ").strip()
     
@@ -206,11 +428,19 @@ def main():
         sys.exit(1)
     
     # Process audio
-    if not analyzer.load_audio(filename):
-        sys.exit(1)
-    
-    print("\n🔍 Analyzing audio...")
-    brightness_levels, energy_levels = analyzer.calculate_brightness(window_ms=100)
+    if stream:
+        # Long tracks: analyze block by block instead of loading everything
+        print("\n🔍 Analyzing audio...")
+        result = analyzer.stream_brightness(filename, window_ms=100)
+        if result is None:
+            sys.exit(1)
+        brightness_levels, energy_levels = result
+    else:
+        if not analyzer.load_audio(filename):
+            sys.exit(1)
+        
+        print("\n🔍 Analyzing audio...")
+        brightness_levels, energy_levels = analyzer.calculate_brightness(window_ms=100)
     
     # Generate outputs
     base_name = os.path.splitext(os.path.basename(filename))[0]
@@ -227,7 +457,8 @@ def main():
     analyzer.export_arduino_data(
         brightness_levels, 
         100, 
-        "brightness_data.h"
+        "brightness_data.h",
+        analyzer.stats
     )
     
     print(f"\n✅ Done! Include 'brightness_data.h' in your Arduino project")